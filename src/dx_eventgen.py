@@ -1,27 +1,95 @@
+import os
 import sys
+import json
 import yaml
 from pathlib import Path
+from typing import Callable
 import difflib
+import functools
+
+try:
+    from rapidfuzz import fuzz as rf_fuzz, process as rf_process  # optional, C-backed fuzzy matching
+except ImportError:
+    rf_fuzz = rf_process = None
 
 TAB = "\t"
 DEFAULT_LANG = "tc"  # current output target
 
+# prebuilt indents; deeper nesting falls back to TAB * level
+INDENTS = tuple(TAB * i for i in range(16))
+
+# bump when load_enum_map's output changes, so older sidecar caches are ignored
+ENUM_CACHE_VERSION = 1
+
+# libyaml-backed loader when available (same safe semantics, C scanner)
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 def dx_line(level: int, text: str) -> str:
-    return (TAB * level) + text + "\n"
+    try:
+        return INDENTS[level] + text + "\n"
+    except IndexError:
+        return (TAB * level) + text + "\n"
+
+def as_str(value) -> str:
+    # YAML scalars are nearly always str already; skip the str() call for those
+    return value if type(value) is str else str(value)
+
+MIN_PARTIAL_KEY = 3
+
+@functools.lru_cache(maxsize=256)
+def suggest_key(key: str, candidates: tuple[str, ...]) -> str:
+    # cheap pass first: case-insensitive prefix, then substring (shortest first);
+    # fuzzy matching only runs when neither finds anything. Keys shorter than
+    # MIN_PARTIAL_KEY are contained in too many names to mean anything.
+    matches = []
+    lk = key.lower()
+    if len(lk) >= MIN_PARTIAL_KEY:
+        folded = [(c.lower(), c) for c in candidates]
+        matches = sorted((c for lc, c in folded if lc.startswith(lk)), key=len)[:3]
+        if not matches:
+            matches = sorted((c for lc, c in folded if lk in lc), key=len)[:3]
+
+    if not matches:
+        # difflib decides the fuzzy suggestions either way, so they don't depend
+        # on whether rapidfuzz is installed; the prefilters only drop
+        # candidates that can't reach its 0.6 cutoff
+        if rf_process is not None:
+            # fuzz.ratio is 2*LCS/total, never below difflib's ratio; the cutoff
+            # sits a little under 60 so float rounding can't drop a candidate
+            filtered = [m[0] for m in rf_process.extract(key, candidates, scorer=rf_fuzz.ratio, limit=None, score_cutoff=59)]
+        else:
+            # the real_quick_ratio bound: length alone keeps these under the cutoff
+            n = len(key)
+            filtered = [c for c in candidates if 2.0 * min(n, len(c)) / max(1, n + len(c)) >= 0.6]
+        matches = difflib.get_close_matches(key, filtered, n=3, cutoff=0.6)
 
-def suggest_key(key: str, candidates: list[str]) -> str:
-    matches = difflib.get_close_matches(key, candidates, n=3, cutoff=0.6)
     if matches:
         return " Did you mean: " + ", ".join(matches) + " ?"
     return ""
 
+# A YAML node path is either a plain string or a (parent, segment, ...) tuple
+# whose segments are string suffixes or int list indexes. Handlers pass
+# tuples down so nothing is formatted unless an error is actually raised.
+NodePath = str | tuple
+
+def format_path(path: NodePath) -> str:
+    if type(path) is str:
+        return path
+    out = []
+    for seg in path:
+        if type(seg) is int:
+            out.append(f"[{seg}]")
+        else:
+            out.append(format_path(seg))
+    return "".join(out)
+
 class CompileError(Exception):
-    def __init__(self, message: str, input_file: str = "", path: str = ""):
+    def __init__(self, message: str, input_file: str = "", path: NodePath = ""):
         parts = []
         if input_file:
             parts.append(f"File: {input_file}")
         if path:
-            parts.append(f"Path: {path}")
+            parts.append(f"Path: {format_path(path)}")
         if parts:
             super().__init__("\n".join(parts) + "\nError: " + message)
         else:
@@ -38,12 +106,14 @@ def load_enum_map(path: Path, lang: str = DEFAULT_LANG) -> dict:
             sc: ""
             jp: ""
           comment: ...
-    Returns: dict[key] = resolved_value_string
+    Returns: dict[key] = resolved_value_string (interned; DX tokens repeat
+    across lines and compare by identity)
     """
     if not path.exists():
         return {}
 
-    data = yaml.safe_load(path.read_text(encoding="utf-8"))
+    with path.open("rb") as f:  # libyaml pulls the file in chunks
+        data = yaml.load(f, Loader=Loader)
     if data is None:
         return {}
     if not isinstance(data, dict):
@@ -51,211 +121,374 @@ def load_enum_map(path: Path, lang: str = DEFAULT_LANG) -> dict:
 
     out = {}
     for k, v in data.items():
-        k = str(k)
+        k = as_str(k)
 
         if isinstance(v, str):
             if lang != "tc":
                 raise ValueError(f"Legacy enum entry only supports tc: {path.as_posix()} key '{k}'")
-            out[k] = v
+            out[k] = sys.intern(v)
             continue
 
-        if isinstance(v, dict) and "value" in v and isinstance(v["value"], dict):
-            vv = v["value"]
+        vv = v.get("value") if isinstance(v, dict) else None
+        if not isinstance(vv, dict):
+            raise ValueError(
+                f"Invalid enum entry in {path.as_posix()} for key '{k}'. "
+                f"Expected string OR object with value.tc"
+            )
+
+        # blank or non-string values fall back to tc
+        val = vv.get(lang)
+        val = val.strip() if isinstance(val, str) else ""
+        if not val:
+            val = vv.get("tc")
+            val = val.strip() if isinstance(val, str) else ""
+            if not val:
+                raise ValueError(f"Enum entry missing value.{lang} (and no tc fallback): {path.as_posix()} key '{k}'")
+        out[k] = sys.intern(val)
+
+    return out
+
+def read_enum_cache(path: Path, lang: str = DEFAULT_LANG) -> dict | None:
+    """
+    Cached map for an enum file, stored as a JSON sidecar next to it:
+      enums/core/characters.yaml -> enums/core/characters.tc.cache.json
+    The sidecar records the source mtime/size and ENUM_CACHE_VERSION;
+    returns None when it is missing, unreadable or stale.
+    """
+    try:
+        st = path.stat()
+        cached = json.loads(path.with_suffix(f".{lang}.cache.json").read_bytes())
+        if cached["stamp"] != [ENUM_CACHE_VERSION, st.st_mtime_ns, st.st_size]:
+            return None
+        intern = sys.intern
+        return {k: intern(v) for k, v in cached["map"].items()}
+    except Exception:
+        return None
+
+@functools.lru_cache(maxsize=None)
+def load_enum_pairs(path_str: str, mtime_ns: int, size: int, lang: str) -> tuple[tuple[str, str], ...]:
+    """
+    In-process memo for load_enum_map_cached(), keyed by the file's stamp so an
+    edited file is read again. Returned as pairs so the memoized value can't be
+    mutated by a caller.
+    """
+    path = Path(path_str)
+    cached = read_enum_cache(path, lang=lang)
+    if cached is not None:
+        return tuple(cached.items())
 
-            if lang in vv and isinstance(vv[lang], str) and vv[lang].strip() != "":
-                out[k] = vv[lang].strip()
-                continue
+    stamp = (ENUM_CACHE_VERSION, mtime_ns, size)
+    out = load_enum_map(path, lang=lang)
 
-            if "tc" in vv and isinstance(vv["tc"], str) and vv["tc"].strip() != "":
-                out[k] = vv["tc"].strip()
-                continue
+    cache = path.with_suffix(f".{lang}.cache.json")
+    tmp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_text(json.dumps({"stamp": stamp, "map": out}, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, cache)
+    except OSError:
+        try:
+            tmp.unlink(missing_ok=True)
+        except OSError:
+            pass
 
-            raise ValueError(f"Enum entry missing value.{lang} (and no tc fallback): {path.as_posix()} key '{k}'")
+    return tuple(out.items())
 
-        raise ValueError(
-            f"Invalid enum entry in {path.as_posix()} for key '{k}'. "
-            f"Expected string OR object with value.tc"
-        )
+def load_enum_map_cached(path: Path, lang: str = DEFAULT_LANG) -> dict:
+    """
+    load_enum_map() backed by read_enum_cache(); a missing or stale cache is rebuilt.
+    Cache write failures are ignored (the parsed map is still returned).
+    Within one process each file is parsed at most once per mtime/size.
+    """
+    if not path.exists():
+        return {}
 
-    return out
+    st = path.stat()
+    return dict(load_enum_pairs(path.as_posix(), st.st_mtime_ns, st.st_size, lang))
 
 class EnumRegistry:
     """
-    Auto-load all enums/core/*.yaml as categories by filename stem.
+    Auto-register all enums/core/*.yaml as categories by filename stem.
       enums/core/characters.yaml -> category 'characters'
       enums/core/locations.yaml  -> category 'locations'
       enums/core/bgm.yaml        -> category 'bgm'
       enums/core/sfx.yaml        -> category 'sfx'
+    A category's file is only parsed on its first get().
     """
+    __slots__ = ("lang", "sources", "legacy_only", "categories", "keys", "getters", "memo")
+
     def __init__(self, repo_root: Path, lang: str = DEFAULT_LANG):
         self.lang = lang
         self.categories: dict[str, dict[str, str]] = {}
 
+        # category -> files to try in order; the legacy file is only used
+        # when the core one is empty
+        self.sources: dict[str, list[Path]] = {}
+
         core_dir = repo_root / "enums" / "core"
         old_dir = repo_root / "enums"  # legacy fallback (optional)
 
         if core_dir.exists():
             for p in sorted(core_dir.glob("*.yaml")):
-                cat = p.stem
-                self.categories[cat] = load_enum_map(p, lang=self.lang)
+                self.sources[p.stem] = [p]
 
-        # legacy fallback only if core missing that category
         if old_dir.exists():
             for p in sorted(old_dir.glob("*.yaml")):
-                cat = p.stem
-                if cat not in self.categories or not self.categories[cat]:
-                    m = load_enum_map(p, lang=self.lang)
-                    if m:
-                        self.categories[cat] = m
-
-    def get(self, category: str, key: str, *, input_file: str, path: str) -> str:
-        category = str(category)
-        key = str(key)
-        if category not in self.categories:
+                self.sources.setdefault(p.stem, []).append(p)
+
+        # stems with only a legacy file; those are categories only when the
+        # file has entries, which is known once it has been loaded
+        self.legacy_only = frozenset(c for c, paths in self.sources.items() if paths[0].parent == old_dir)
+
+        # enum keys never change after load; candidate tuples for suggest_key
+        # are built on the first miss of each category
+        self.keys: dict[str, tuple[str, ...]] = {}
+
+        # category -> get() closed over that category's map; one dict lookup
+        # per key instead of going through self.categories each time
+        self.getters: dict[str, Callable[..., str]] = {}
+
+        # rendered fragments keyed by the enum keys they were built from
+        self.memo: dict[tuple, str] = {}
+
+    def load(self, category: str) -> dict[str, str]:
+        mapping: dict[str, str] = {}
+        for p in self.sources[category]:
+            mapping = load_enum_map_cached(p, lang=self.lang)
+            if mapping:
+                break
+        self.categories[category] = mapping
+        return mapping
+
+    def make_getter(self, category: str) -> Callable[..., str]:
+        """Return get() bound to one category's map, loading it if needed."""
+        mapping = self.categories.get(category)
+        if mapping is None:
+            mapping = self.load(category)
+        keys = self.keys
+
+        def get_key(key: str, *, input_file: str, path: NodePath) -> str:
+            key = as_str(key)
+            value = mapping.get(key)
+            if value is not None:
+                return value
+            candidates = keys.get(category)
+            if candidates is None:
+                candidates = keys[category] = tuple(mapping)
             raise CompileError(
-                f"Unknown enum category '{category}'. Available: {', '.join(sorted(self.categories.keys()))}",
+                f"Unknown {category} '{key}'." + suggest_key(key, candidates),
                 input_file=input_file,
                 path=path,
             )
-        mapping = self.categories[category]
-        if key in mapping:
-            return mapping[key]
-        raise CompileError(
-            f"Unknown {category} '{key}'." + suggest_key(key, list(mapping.keys())),
-            input_file=input_file,
-            path=path,
-        )
-
-def emit_time_before_year_month(level: int, year: int, month: int) -> str:
-    out = ""
-    out += dx_line(level, "ＯＲ調查:{")
-    out += dx_line(level + 1, f"調查:(狀況::年)<({year})")
-    out += dx_line(level + 1, "ＡＮＤ調查:{")
-    out += dx_line(level + 2, f"調查:(狀況::年)==({year})")
-    out += dx_line(level + 2, f"調查:(狀況::月)<({month})")
-    out += dx_line(level + 1, "}")
-    out += dx_line(level, "}")
-    return out
 
-def compile_require(require: dict, enums: EnumRegistry, *, input_file: str) -> str:
+        return get_key
+
+    def is_category(self, category: str) -> bool:
+        if category not in self.sources:
+            return False
+        if category not in self.legacy_only:
+            return True
+        mapping = self.categories.get(category)
+        if mapping is None:
+            mapping = self.load(category)
+        return bool(mapping)
+
+    def get(self, category: str, key: str, *, input_file: str, path: NodePath) -> str:
+        category = as_str(category)
+        getter = self.getters.get(category)
+        if getter is None:
+            if not self.is_category(category):
+                available = sorted(c for c in self.sources if self.is_category(c))
+                raise CompileError(
+                    f"Unknown enum category '{category}'. Available: {', '.join(available)}",
+                    input_file=input_file,
+                    path=path,
+                )
+            getter = self.getters[category] = self.make_getter(category)
+        return getter(key, input_file=input_file, path=path)
+
+@functools.lru_cache(maxsize=None)
+def time_before_year_month_parts(level: int) -> tuple[str, str, str, str]:
+    """Constant text around year, year and month, rendered once per level."""
+    i0, i1, i2 = TAB * level, TAB * (level + 1), TAB * (level + 2)
+    return (
+        f"{i0}ＯＲ調查:{{\n{i1}調查:(狀況::年)<(",
+        f")\n{i1}ＡＮＤ調查:{{\n{i2}調查:(狀況::年)==(",
+        f")\n{i2}調查:(狀況::月)<(",
+        f")\n{i1}}}\n{i0}}}\n",
+    )
+
+def emit_time_before_year_month(write: Callable[[str], None], level: int, year: int, month: int) -> None:
+    a, b, c, d = time_before_year_month_parts(level)
+    write(f"{a}{year}{b}{year}{c}{month}{d}")
+
+NO_MISSION_LINE = dx_line(3, "調查:(人物::主角.主命狀態)==(無主命)")
+
+def compile_require(require: dict, enums: EnumRegistry, write: Callable[[str], None], *, input_file: str) -> None:
     if require is None:
-        return ""
+        return
     if not isinstance(require, dict):
         raise CompileError("'require' must be an object.", input_file=input_file, path="require")
 
-    out = ""
-
     if "before_year_month" in require:
         bym = require["before_year_month"]
         if not isinstance(bym, dict):
             raise CompileError("'before_year_month' must be an object.", input_file=input_file, path="require.before_year_month")
         if "year" not in bym or "month" not in bym:
             raise CompileError("before_year_month requires 'year' and 'month'.", input_file=input_file, path="require.before_year_month")
-        out += emit_time_before_year_month(3, int(bym["year"]), int(bym["month"]))
+        emit_time_before_year_month(write, 3, int(bym["year"]), int(bym["month"]))
 
     if "gender" in require:
         g = enums.get("gender", require["gender"], input_file=input_file, path="require.gender")
-        out += dx_line(3, f"調查:(人物::主角.性別)==({g})")
+        write(dx_line(3, f"調查:(人物::主角.性別)==({g})"))
 
     if require.get("no_task", False):
-        out += dx_line(3, "調查:(人物::主角.主命狀態)==(無主命)")
+        write(NO_MISSION_LINE)
 
     if "faction_type" in require:
         ft = enums.get("faction_types", require["faction_type"], input_file=input_file, path="require.faction_type")
-        out += dx_line(3, f"調查:(人物::主角.所屬勢力類型)==({ft})")
+        write(dx_line(3, f"調查:(人物::主角.所屬勢力類型)==({ft})"))
 
     if "money_gt" in require:
-        out += dx_line(3, f"調查:(主角.持有金)>({int(require['money_gt'])})")
-
-    return out
-
-def compile_script_block(script: list, enums: EnumRegistry, *, input_file: str, base_path: str, level: int) -> str:
+        write(dx_line(3, f"調查:(主角.持有金)>({int(require['money_gt'])})"))
+
+def compile_narration(write: Callable[[str], None], text, enums: EnumRegistry, *, input_file: str, path: NodePath, level: int) -> None:
+    write(dx_line(level, f"旁白:[[{text}]]"))
+
+def compile_hero_think(write: Callable[[str], None], text, enums: EnumRegistry, *, input_file: str, path: NodePath, level: int) -> None:
+    write(dx_line(level, f"自言自語:[[{text}]]"))
+
+def compile_bgm(write: Callable[[str], None], key, enums: EnumRegistry, *, input_file: str, path: NodePath, level: int) -> None:
+    memo_key = ("bgm", as_str(key))
+    text = enums.memo.get(memo_key)
+    if text is None:
+        bgm_val = enums.get("bgm", key, input_file=input_file, path=(path, ".bgm"))
+        text = enums.memo[memo_key] = f"背景音樂變更:({bgm_val})"
+    write(dx_line(level, text))
+
+def compile_sfx(write: Callable[[str], None], key, enums: EnumRegistry, *, input_file: str, path: NodePath, level: int) -> None:
+    memo_key = ("sfx", as_str(key))
+    text = enums.memo.get(memo_key)
+    if text is None:
+        sfx_val = enums.get("sfx", key, input_file=input_file, path=(path, ".sfx"))
+        text = enums.memo[memo_key] = f"音效開始:({sfx_val})"
+    write(dx_line(level, text))
+
+def compile_say(write: Callable[[str], None], say: dict, enums: EnumRegistry, *, input_file: str, path: NodePath, level: int) -> None:
+    try:
+        speaker, listener, text = say["speaker"], say["listener"], say["text"]
+    except TypeError:
+        raise CompileError("'say' must be an object.", input_file=input_file, path=(path, ".say")) from None
+    except KeyError as e:
+        raise CompileError(f"Missing '{e.args[0]}' in say.", input_file=input_file, path=(path, ".say.", e.args[0])) from None
+
+    memo_key = ("say", as_str(speaker), as_str(listener))
+    prefix = enums.memo.get(memo_key)
+    if prefix is None:
+        sp = enums.get("characters", speaker, input_file=input_file, path=(path, ".say.speaker"))
+        ls = enums.get("characters", listener, input_file=input_file, path=(path, ".say.listener"))
+        prefix = enums.memo[memo_key] = f"對話:({sp},{ls})"
+    write(dx_line(level, f"{prefix}[[{text}]]"))
+
+def compile_rename_say(write: Callable[[str], None], rs: dict, enums: EnumRegistry, *, input_file: str, path: NodePath, level: int) -> None:
+    try:
+        speaker, listener = rs["speaker"], rs["listener"]
+        surname, name, text = rs["surname"], rs["name"], rs["text"]
+    except TypeError:
+        raise CompileError("'rename_say' must be an object.", input_file=input_file, path=(path, ".rename_say")) from None
+    except KeyError as e:
+        raise CompileError(f"Missing '{e.args[0]}' in rename_say.", input_file=input_file, path=(path, ".rename_say.", e.args[0])) from None
+
+    memo_key = ("rename_say", as_str(speaker), as_str(listener))
+    prefix = enums.memo.get(memo_key)
+    if prefix is None:
+        sp = enums.get("characters", speaker, input_file=input_file, path=(path, ".rename_say.speaker"))
+        ls = enums.get("characters", listener, input_file=input_file, path=(path, ".rename_say.listener"))
+        prefix = enums.memo[memo_key] = f"變名對話:({sp},{ls},"
+    write(dx_line(level, f"{prefix}[[{surname}]],[[{name}]])[[{text}]]"))
+
+def compile_choice(write: Callable[[str], None], choice: dict, enums: EnumRegistry, *, input_file: str, path: NodePath, level: int) -> None:
+    try:
+        options = choice["options"]
+    except TypeError:
+        raise CompileError("'choice' must be an object.", input_file=input_file, path=(path, ".choice")) from None
+    except KeyError:
+        options = None
+    if not isinstance(options, list):
+        raise CompileError("choice.options must be a list.", input_file=input_file, path=(path, ".choice.options"))
+
+    # one pass: validate each option and render its branch; the 選擇 header
+    # needs every label, so branches are buffered until the loop is done
+    labels = []
+    branches: list[str] = []
+    for oi, opt in enumerate(options):
+        op = (path, ".choice.options", oi)
+        try:
+            label = as_str(opt["label"])
+            do = opt["do"]
+        except TypeError:
+            raise CompileError("Each option must be an object.", input_file=input_file, path=op) from None
+        except KeyError as e:
+            raise CompileError(f"Missing option.{e.args[0]}", input_file=input_file, path=(op, ".", e.args[0])) from None
+        labels.append(label)
+        branches.append(dx_line(level, f"分歧:([[{label}]])" + "{"))
+        compile_script_block(do, enums, branches.append, input_file=input_file, base_path=(op, ".do"), level=level + 1)
+        branches.append(dx_line(level, "}"))
+
+    # "[[a]][[b]]" in one join over the labels; an empty choice stays "選擇:()"
+    marked = "[[" + "]][[".join(labels) + "]]" if labels else ""
+    write(dx_line(level, f"選擇:({marked})"))
+    write("".join(branches))
+
+# script command key -> handler(write, value, enums, ...) where value is
+# entry[key]; order is the order reported in errors
+SCRIPT_COMMANDS = {
+    "narration": compile_narration,
+    "hero_think": compile_hero_think,
+    "bgm": compile_bgm,
+    "sfx": compile_sfx,
+    "say": compile_say,
+    "rename_say": compile_rename_say,
+    "choice": compile_choice,
+}
+KNOWN_COMMANDS_TEXT = ", ".join(SCRIPT_COMMANDS)
+
+def compile_script_block(script: list, enums: EnumRegistry, write: Callable[[str], None], *, input_file: str, base_path: NodePath, level: int) -> None:
     if not isinstance(script, list):
         raise CompileError("Script block must be a list.", input_file=input_file, path=base_path)
 
-    out = ""
+    get_handler = SCRIPT_COMMANDS.get  # bound once for the loop
     for i, cmd in enumerate(script):
-        p = f"{base_path}[{i}]"
-        if not isinstance(cmd, dict):
-            raise CompileError("Each script entry must be an object.", input_file=input_file, path=p)
-
-        if "narration" in cmd:
-            out += dx_line(level, f"旁白:[[${str(cmd['narration'])}]]".replace("$", ""))
-
-        elif "hero_think" in cmd:
-            out += dx_line(level, f"自言自語:[[${str(cmd['hero_think'])}]]".replace("$", ""))
-
-        elif "bgm" in cmd:
-            bgm_val = enums.get("bgm", cmd["bgm"], input_file=input_file, path=f"{p}.bgm")
-            out += dx_line(level, f"背景音樂變更:({bgm_val})")
-
-        elif "sfx" in cmd:
-            sfx_val = enums.get("sfx", cmd["sfx"], input_file=input_file, path=f"{p}.sfx")
-            out += dx_line(level, f"音效開始:({sfx_val})")
-
-        elif "say" in cmd:
-            say = cmd["say"]
-            if not isinstance(say, dict):
-                raise CompileError("'say' must be an object.", input_file=input_file, path=f"{p}.say")
-            for k in ("speaker", "listener", "text"):
-                if k not in say:
-                    raise CompileError(f"Missing '{k}' in say.", input_file=input_file, path=f"{p}.say.{k}")
-
-            sp = enums.get("characters", say["speaker"], input_file=input_file, path=f"{p}.say.speaker")
-            ls = enums.get("characters", say["listener"], input_file=input_file, path=f"{p}.say.listener")
-            out += dx_line(level, f"對話:({sp},{ls})[[{str(say['text'])}]]")
-
-        elif "rename_say" in cmd:
-            rs = cmd["rename_say"]
-            if not isinstance(rs, dict):
-                raise CompileError("'rename_say' must be an object.", input_file=input_file, path=f"{p}.rename_say")
-            for k in ("speaker", "listener", "surname", "name", "text"):
-                if k not in rs:
-                    raise CompileError(f"Missing '{k}' in rename_say.", input_file=input_file, path=f"{p}.rename_say.{k}")
-
-            sp = enums.get("characters", rs["speaker"], input_file=input_file, path=f"{p}.rename_say.speaker")
-            ls = enums.get("characters", rs["listener"], input_file=input_file, path=f"{p}.rename_say.listener")
-            out += dx_line(level, f"變名對話:({sp},{ls},[[{rs['surname']}]],[[{rs['name']}]])[[{rs['text']}]]")
-
-        elif "choice" in cmd:
-            choice = cmd["choice"]
-            if not isinstance(choice, dict):
-                raise CompileError("'choice' must be an object.", input_file=input_file, path=f"{p}.choice")
-            if "options" not in choice or not isinstance(choice["options"], list):
-                raise CompileError("choice.options must be a list.", input_file=input_file, path=f"{p}.choice.options")
-
-            options = choice["options"]
-            labels = []
-            for oi, opt in enumerate(options):
-                op = f"{p}.choice.options[{oi}]"
-                if not isinstance(opt, dict):
-                    raise CompileError("Each option must be an object.", input_file=input_file, path=op)
-                if "label" not in opt:
-                    raise CompileError("Missing option.label", input_file=input_file, path=f"{op}.label")
-                if "do" not in opt:
-                    raise CompileError("Missing option.do", input_file=input_file, path=f"{op}.do")
-                labels.append(str(opt["label"]))
-
-            out += dx_line(level, "選擇:(" + "".join([f"[[{lb}]]" for lb in labels]) + ")")
-
-            for oi, opt in enumerate(options):
-                op = f"{p}.choice.options[{oi}]"
-                lb = str(opt["label"])
-                out += dx_line(level, f"分歧:([[{lb}]])" + "{")
-                out += compile_script_block(opt["do"], enums, input_file=input_file, base_path=f"{op}.do", level=level + 1)
-                out += dx_line(level, "}")
-
-        else:
-            known = ["narration", "hero_think", "bgm", "sfx", "say", "rename_say", "choice"]
-            raise CompileError(
-                "Unknown script command. Expected one of: " + ", ".join(known),
-                input_file=input_file,
-                path=p,
-            )
-
-    return out
-
-def generate_event(data: dict, enums: EnumRegistry, *, input_file: str) -> str:
+        p = (base_path, i)
+        try:
+            keys = cmd.keys()
+        except AttributeError:
+            raise CompileError("Each script entry must be an object.", input_file=input_file, path=p) from None
+
+        # fast path: an entry is almost always a single command key
+        handler = None
+        if len(keys) == 1:
+            name = next(iter(keys))
+            handler = get_handler(name)
+        if handler is None:
+            matched = keys & SCRIPT_COMMANDS.keys()
+            if len(matched) != 1:
+                if matched:
+                    raise CompileError(
+                        "Script entry has more than one command: " + ", ".join(k for k in SCRIPT_COMMANDS if k in matched),
+                        input_file=input_file,
+                        path=p,
+                    )
+                raise CompileError(
+                    "Unknown script command. Expected one of: " + KNOWN_COMMANDS_TEXT,
+                    input_file=input_file,
+                    path=p,
+                )
+            name = next(iter(matched))
+            handler = SCRIPT_COMMANDS[name]
+
+        handler(write, cmd[name], enums, input_file=input_file, path=p, level=level)
+
+def emit_event(data: dict, enums: EnumRegistry, write: Callable[[str], None], *, input_file: str) -> None:
     if not isinstance(data, dict):
         raise CompileError("Root YAML must be an object.", input_file=input_file, path="$")
 
@@ -281,31 +514,30 @@ def generate_event(data: dict, enums: EnumRegistry, *, input_file: str) -> str:
     if "facility" not in trigger:
         raise CompileError("trigger requires 'facility'.", input_file=input_file, path="trigger.facility")
 
-    event_name = str(data["event_name"])
+    event_name = as_str(data["event_name"])
     once = bool(data.get("once", True))
 
     location = enums.get("locations", loc_key, input_file=input_file, path=loc_path)
     facility = enums.get("facilities", trigger["facility"], input_file=input_file, path="trigger.facility")
 
-    require_block = compile_require(data.get("require", None), enums, input_file=input_file)
-    script_block = compile_script_block(data.get("script", []), enums, input_file=input_file, base_path="script", level=3)
-
-    out = ""
-    out += "太閣立志傳５事件原始碼\n"
-    out += "章節:{\n"
-    out += dx_line(1, f"事件:{event_name}" + "{")
-    if once:
-        out += dx_line(2, "屬性:僅限一次")
-    out += dx_line(2, f"發生時機:室內畫面顯示後({location},{facility})")
-    out += dx_line(2, "發生條件:{")
-    out += require_block
-    out += dx_line(2, "}")
-    out += dx_line(2, "腳本:{")
-    out += script_block
-    out += dx_line(2, "}")
-    out += dx_line(1, "}")
-    out += "}\n"
-    return out
+    once_line = "\t\t屬性:僅限一次\n" if once else ""
+    write(
+        "太閣立志傳５事件原始碼\n"
+        "章節:{\n"
+        f"\t事件:{event_name}{{\n"
+        f"{once_line}"
+        f"\t\t發生時機:室內畫面顯示後({location},{facility})\n"
+        "\t\t發生條件:{\n"
+    )
+    compile_require(data.get("require", None), enums, write, input_file=input_file)
+    write("\t\t}\n\t\t腳本:{\n")
+    compile_script_block(data.get("script", []), enums, write, input_file=input_file, base_path="script", level=3)
+    write("\t\t}\n\t}\n}\n")
+
+def generate_event(data: dict, enums: EnumRegistry, *, input_file: str) -> str:
+    parts: list[str] = []
+    emit_event(data, enums, parts.append, input_file=input_file)
+    return "".join(parts)
 
 def main():
     if len(sys.argv) != 3:
@@ -320,11 +552,24 @@ def main():
         repo_root = Path(__file__).resolve().parents[1]
         enums = EnumRegistry(repo_root, lang=DEFAULT_LANG)
 
-        data = yaml.safe_load(input_path.read_text(encoding="utf-8"))
-        dx_script = generate_event(data, enums, input_file=input_file)
-
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        output_path.write_text(dx_script, encoding="utf-16")
+        data = yaml.load(input_path.read_bytes(), Loader=Loader)
+
+        # stream into a temp file; only a fully compiled event replaces output_path.
+        # The temp file goes in the nearest existing directory (same filesystem
+        # as any directories created for the output), and those directories
+        # are only created once the event has compiled.
+        tmp_dir = output_path.parent
+        while not tmp_dir.is_dir() and tmp_dir != tmp_dir.parent:
+            tmp_dir = tmp_dir.parent
+        tmp_path = tmp_dir / (output_path.name + ".tmp")
+        try:
+            with tmp_path.open("w", encoding="utf-16") as f:
+                emit_event(data, enums, f.write, input_file=input_file)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
         print(f"Generated: {output_path}")
 
     except CompileError as e:
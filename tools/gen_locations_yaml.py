@@ -1,18 +1,23 @@
 from __future__ import annotations
 from pathlib import Path
+from typing import Callable
 import csv
+import functools
+import io
+import json
+import os
 import re
 import sys
 
-try:
-    from pykakasi import kakasi
-except Exception:
-    print("Missing dependency: pykakasi. Install with: pip3 install pykakasi", file=sys.stderr)
-    raise
+import yaml
+
+# libyaml-backed loader/dumper when PyYAML was built with it
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
 
 
 # Ignore non-location meta rows
-IGNORE_EXACT = {
+IGNORE_EXACT = frozenset({
     "拠点", "城", "町", "忍の里", "海賊の砦",
     "目標拠点", "発生拠点", "主人公拠点", "主人公当主拠点",
     "主人公居城", "主人公当主居城",
@@ -22,38 +27,42 @@ IGNORE_EXACT = {
     "里Ａ", "里Ｂ", "里Ｃ", "里Ｄ", "里Ｅ",
     "砦Ａ", "砦Ｂ", "砦Ｃ", "砦Ｄ", "砦Ｅ",
     "無効",
+})
+
+# last character -> (suffix, kind); a location is "<base><suffix>" with a
+# non-empty base. The suffixes all end in a different character, so one
+# dict lookup picks the only suffix that can match.
+SUFFIXES = {
+    "城": ("城", "Castle"),
+    "町": ("の町", "Town"),
+    "里": ("の里", "Village"),
+    "砦": ("砦", "PirateBase"),
 }
 
-PAT_CASTLE = re.compile(r".+城$")
-PAT_TOWN   = re.compile(r".+の町$")
-PAT_VILL   = re.compile(r".+の里$")
-PAT_FORT   = re.compile(r".+砦$")
-
 
-def is_real_location(jp: str) -> bool:
-    if not jp or jp in IGNORE_EXACT:
-        return False
-    return bool(
-        PAT_CASTLE.match(jp)
-        or PAT_TOWN.match(jp)
-        or PAT_VILL.match(jp)
-        or PAT_FORT.match(jp)
-    )
+def classify(jp: str) -> tuple[str, str] | None:
+    """Return (kind, base) for a real location name, None for anything else."""
+    hit = SUFFIXES.get(jp[-1:])
+    if hit is None:
+        return None
+    suf, kind = hit
+    if len(jp) <= len(suf) or not jp.endswith(suf) or jp in IGNORE_EXACT:
+        return None
+    return kind, jp[:-len(suf)]
 
 
-def strip_suffix(jp: str) -> tuple[str, str]:
-    if PAT_CASTLE.match(jp):
-        return "Castle", jp[:-1]
-    if PAT_TOWN.match(jp):
-        return "Town", jp[:-2]
-    if PAT_VILL.match(jp):
-        return "Village", jp[:-2]
-    if PAT_FORT.match(jp):
-        return "PirateBase", jp[:-1]
-    raise ValueError(f"Unexpected location format: {jp}")
+# Avoid generic entries
+GENERIC_BASES = frozenset({"城", "町", "里", "砦"})
 
 
 def build_kakasi():
+    # imported here so runs served entirely from the romaji cache never load it
+    try:
+        from pykakasi import kakasi
+    except Exception:
+        print("Missing dependency: pykakasi. Install with: pip3 install pykakasi", file=sys.stderr)
+        raise
+
     k = kakasi()
     k.setMode("H", "a")
     k.setMode("K", "a")
@@ -63,17 +72,117 @@ def build_kakasi():
     return k.getConverter()
 
 
+# the committed table, used whichever CSV is passed unless a path is given
+DEFAULT_ROMAJI_CACHE = Path(__file__).resolve().parents[1] / "data" / "romaji_cache.yaml"
+
+
+def load_romaji_cache(path: Path) -> dict[str, str]:
+    """
+    base -> romaji pairs (data/romaji_cache.yaml by default).
+    Entries can be edited by hand to pin a romanization.
+    """
+    if not path.exists():
+        return {}
+    data = yaml.load(path.read_bytes(), Loader=Loader)
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError(f"Romaji cache must be a YAML mapping: {path.as_posix()}")
+    return {str(k): str(v) for k, v in data.items()}
+
+
+def save_romaji_cache(path: Path, cache: dict[str, str]) -> None:
+    body = yaml.dump(
+        dict(sorted(cache.items())),
+        Dumper=Dumper,
+        allow_unicode=True,
+        default_flow_style=False,
+        sort_keys=False,
+    )
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_text(
+            "# Romaji for location bases, filled from pykakasi by tools/gen_locations_yaml.py.\n"
+            "# Edit an entry to override its romanization.\n" + body,
+            encoding="utf-8",
+        )
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+PASCAL_CLEAN = re.compile(r"[^A-Za-z0-9\s\-']")
+PASCAL_SPLIT = re.compile(r"[\s\-']+")
+
+
+@functools.lru_cache(maxsize=None)
 def pascalize(romaji: str) -> str:
-    s = romaji.strip()
-    s = re.sub(r"[^A-Za-z0-9\s\-']", " ", s)
-    parts = re.split(r"[\s\-']+", s)
-    parts = [p for p in parts if p]
+    # kakasi output is normally ASCII words and spaces; no regex needed
+    if romaji.isascii() and romaji.replace(" ", "").isalnum():
+        return "".join(p.capitalize() for p in romaji.split())
+    s = PASCAL_CLEAN.sub(" ", romaji.strip())
+    parts = [p for p in PASCAL_SPLIT.split(s) if p]
     return "".join(p[:1].upper() + p[1:].lower() for p in parts)
 
 
+def process_row(jp: str, tc: str, romaji: Callable[[str], str]) -> tuple[str, str, str, str] | None:
+    """Return (jp, tc, kind, key) for a location row, None if it is skipped."""
+    classified = classify(jp)
+    if classified is None:
+        return None
+    kind, base = classified
+    if base in GENERIC_BASES:
+        return None
+    return jp, tc, kind, kind + pascalize(romaji(base))
+
+
+# plain scalars YAML would read as something other than the same string
+YAML_SPECIAL_WORDS = frozenset({
+    "true", "false", "yes", "no", "on", "off", "y", "n", "null", "~",
+    "=", "<<",  # value and merge keys; SafeLoader can't construct them
+})
+YAML_NUMBER_LIKE = re.compile(r"[-+.0-9][-+.0-9_:a-zA-Z]*")
+YAML_INDICATORS = "-?:,[]{}#&*!|>'\"%@`"
+# characters json.dumps leaves raw that YAML would reject or read as a line
+# break (NEL, LS, PS) inside a double-quoted scalar
+YAML_UNSAFE_IN_QUOTES = re.compile(
+    r"[^\x09\x0A\x0D\x20-\x7E\xA0-\u2027\u202A-\uD7FF\uE000-\uFEFE\uFF00-\uFFFD\U00010000-\U0010FFFF]"
+)
+
+
+def yaml_escape(m: re.Match) -> str:
+    c = ord(m.group())
+    if c < 0x100:
+        return f"\\x{c:02X}"
+    if c < 0x10000:
+        return f"\\u{c:04X}"
+    return f"\\U{c:08X}"
+
+
+def yaml_scalar(s: str) -> str:
+    """Return s as a YAML scalar, double-quoted only when plain would not round-trip."""
+    if (
+        not s
+        or s != s.strip()
+        or s[0] in YAML_INDICATORS
+        or ": " in s
+        or " #" in s
+        or s.endswith(":")
+        or not s.isprintable()
+        or s.lower() in YAML_SPECIAL_WORDS
+        or YAML_NUMBER_LIKE.fullmatch(s)
+    ):
+        # a JSON string is a YAML double-quoted scalar once the YAML-only
+        # breaks and non-printables are escaped too
+        return YAML_UNSAFE_IN_QUOTES.sub(yaml_escape, json.dumps(s, ensure_ascii=False))
+    return s
+
+
 def main():
     if len(sys.argv) < 3:
-        print("Usage: python3 tools/gen_locations_yaml.py data/jp_tc_locations.csv enums/core/locations.yaml")
+        print("Usage: python3 tools/gen_locations_yaml.py data/jp_tc_locations.csv enums/core/locations.yaml [romaji_cache.yaml]")
+        print(f"  romaji_cache.yaml defaults to {DEFAULT_ROMAJI_CACHE.as_posix()}")
         sys.exit(1)
 
     csv_path = Path(sys.argv[1])
@@ -83,100 +192,114 @@ def main():
         print(f"CSV not found: {csv_path}", file=sys.stderr)
         sys.exit(2)
 
-    conv = build_kakasi()
-
-    rows: list[tuple[str, str]] = []
-    with csv_path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.reader(f)
-        header = next(reader, None)
-        if not header or len(header) < 2:
-            print("CSV must have 2 columns: jp, tc", file=sys.stderr)
-            sys.exit(3)
-
-        for r in reader:
-            if len(r) < 2:
-                continue
-            jp = (r[0] or "").strip()
-            tc = (r[1] or "").strip()
-            if not jp or not tc:
-                continue
-            if not is_real_location(jp):
-                continue
-            rows.append((jp, tc))
-
-    out: dict[str, dict] = {}
-    used_keys = set()
-
-    for jp, tc in rows:
-        kind, base = strip_suffix(jp)
-
-        romaji_base = conv.do(base)
-        key = kind + pascalize(romaji_base)
-
-        # Avoid generic entries
-        if base in {"城", "町", "里", "砦"}:
+    # pykakasi is only built when a base is missing from the romaji cache
+    cache_path = Path(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_ROMAJI_CACHE
+    cache = load_romaji_cache(cache_path)
+    missing: list[str] = []
+    conv = None
+
+    def romaji(base: str) -> str:
+        nonlocal conv
+        r = cache.get(base)
+        if r is None:
+            if conv is None:
+                conv = build_kakasi()
+            r = cache[base] = conv.do(base)
+            missing.append(base)
+        return r
+
+    rows: list[tuple[str, str, str, str]] = []
+    # one read and one decode; csv then splits the in-memory text
+    text = csv_path.read_bytes().decode("utf-8-sig")
+    reader = csv.reader(io.StringIO(text, newline=""))
+    header = next(reader, None)
+    if not header or len(header) < 2:
+        print("CSV must have 2 columns: jp, tc", file=sys.stderr)
+        sys.exit(3)
+
+    for r in reader:
+        try:
+            jp, tc = r[0].strip(), r[1].strip()
+        except IndexError:  # blank or one-column row
+            continue
+        if not jp or not tc:
             continue
+        row = process_row(jp, tc, romaji)
+        if row is not None:
+            rows.append(row)
+
+    if missing:
+        # a stale cache only costs pykakasi calls next run; keep going
+        try:
+            save_romaji_cache(cache_path, cache)
+            print(f"Romaji cache: added {len(missing)} base(s) to {cache_path}")
+        except OSError as e:
+            print(f"Warning: could not update romaji cache {cache_path}: {e}", file=sys.stderr)
+
+    # key -> (tc, sc, jp)
+    out: dict[str, tuple[str, str, str]] = {}
+    used_keys = set()
+    # base key -> next numeric suffix to try; every lower suffix is taken
+    next_suffix: dict[str, int] = {}
+    # kind -> keys, filled as entries are built and sorted once per group
+    buckets: dict[str, list[str]] = {kind: [] for _, kind in SUFFIXES.values()}
 
+    for jp, tc, kind, key in rows:
         if key in used_keys:
-            n = 2
+            n = next_suffix.get(key, 2)
             while f"{key}{n}" in used_keys:
                 n += 1
+            next_suffix[key] = n + 1
             key = f"{key}{n}"
 
         used_keys.add(key)
+        buckets[kind].append(key)
 
-        out[key] = {
-            "value": {
-                "tc": tc,
-                "sc": "",
-                "jp": jp
-            },
-            "comment": "Generated from JP↔TC table"
-        }
+        out[key] = (tc, "", jp)
 
     # -------- Beautified output --------
 
-    def group_order(k: str):
-        if k.startswith("Castle"):
-            return (0, k)
-        if k.startswith("Town"):
-            return (1, k)
-        if k.startswith("Village"):
-            return (2, k)
-        if k.startswith("PirateBase"):
-            return (3, k)
-        return (9, k)
-
-    keys_sorted = sorted(out.keys(), key=group_order)
-
-    lines = []
-    lines.append("# Auto-generated file. DO NOT EDIT.")
-    lines.append("# Source: data/jp_tc_locations.csv")
-    lines.append("")
-
-    def emit_group(title: str, prefix: str):
-        group_keys = [k for k in keys_sorted if k.startswith(prefix)]
+    buf = io.StringIO()
+    buf.write("# Auto-generated file. DO NOT EDIT.\n")
+    buf.write("# Source: data/jp_tc_locations.csv\n")
+    buf.write("\n")
+
+    comment = yaml_scalar("Generated from JP↔TC table")
+
+    def emit_group(title: str, kind: str):
+        group_keys = sorted(buckets[kind])
         if not group_keys:
             return
-        lines.append(f"# {title}")
-        lines.append("")
+        buf.write(f"# {title}\n\n")
         for k in group_keys:
-            v = out[k]
-            lines.append(f"{k}:")
-            lines.append("  value:")
-            lines.append(f"    tc: {v['value']['tc']}")
-            lines.append(f"    sc: \"{v['value']['sc']}\"")
-            lines.append(f"    jp: {v['value']['jp']}")
-            lines.append(f"  comment: {v['comment']}")
-            lines.append("")
+            tc, sc, jp = out[k]
+            buf.write(
+                f"{k}:\n"
+                "  value:\n"
+                f"    tc: {yaml_scalar(tc)}\n"
+                f"    sc: {yaml_scalar(sc)}\n"
+                f"    jp: {yaml_scalar(jp)}\n"
+                f"  comment: {comment}\n"
+                "\n"
+            )
 
     emit_group("Castles", "Castle")
     emit_group("Towns", "Town")
     emit_group("Ninja Villages", "Village")
     emit_group("Pirate Bases", "PirateBase")
 
+    text = buf.getvalue().rstrip() + "\n"
+
+    # the emitter is hand-written; make sure every value reads back unchanged
+    # before anything is written
+    loaded = yaml.load(text, Loader=Loader)
+    for k, (tc, sc, jp) in out.items():
+        value = loaded[k]["value"]
+        if (value["tc"], value["sc"], value["jp"]) != (tc, sc, jp):
+            raise ValueError(f"Generated YAML does not round-trip for key '{k}'")
+
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text("\n".join(lines).rstrip() + "\n", encoding="utf-8")
+    out_path.write_text(text, encoding="utf-8")
 
     print(f"Generated: {out_path} ({len(out)} entries)")
 